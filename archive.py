@@ -0,0 +1,331 @@
+import os
+import json
+import mmap
+import pickle
+import sqlite3
+import shutil
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+import utils
+from cache import bump_event_version
+
+ARCHIVE_DIR = os.path.join('instance', 'archive')
+MEDIA_ROOT = 'static'
+BUNDLE_FORMAT = 1
+
+# Per-event media directories under static/, packed and removed as a whole
+EVENT_MEDIA_DIRS = ('uploads', 'faces', 'selfies')
+
+# Tables moved into a bundle, with the condition selecting an event's rows
+ARCHIVED_TABLES = [
+    ('face_clusters', 'event_id = ?', 1),
+    ('images', 'event_id = ?', 1),
+    ('face_crops', 'cluster_id IN (SELECT id FROM face_clusters WHERE event_id = ?) '
+                   'OR image_id IN (SELECT id FROM images WHERE event_id = ?)', 2),
+    ('users', 'event_id = ?', 1),
+    ('access_logs', 'event_id = ?', 1),
+]
+
+# Pickled face encodings are stored as rows of the bundle's float32 matrix
+EMBEDDING_COLUMNS = {
+    'face_clusters': 'average_encoding',
+    'face_crops': 'face_encoding',
+    'users': 'selfie_encoding',
+}
+
+def bundle_dir(event_id):
+    return os.path.join(ARCHIVE_DIR, f'event_{event_id}')
+
+def _media_relpath(path):
+    """Normalize a stored media path to be relative to static/"""
+    path = path.replace('\\', '/')
+    if path.startswith(MEDIA_ROOT + '/'):
+        path = path[len(MEDIA_ROOT) + 1:]
+    return os.path.normpath(path).replace('\\', '/')
+
+
+class EventBundle:
+    """Read-only view of an archived event.
+
+    Media bytes are sliced from a memory-mapped pack file, embeddings are a
+    memory-mapped float32 matrix and table rows are kept as plain dicts.
+    """
+
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.path = bundle_dir(event_id)
+        self.mtime = os.path.getmtime(os.path.join(self.path, 'metadata.json'))
+
+        with open(os.path.join(self.path, 'metadata.json'), 'r') as f:
+            metadata = json.load(f)
+        self.media_index = metadata['media']
+        self.tables = {
+            name: [dict(zip(table['columns'], row)) for row in table['rows']]
+            for name, table in metadata['tables'].items()
+        }
+        self.images_by_id = {row['id']: row for row in self.tables.get('images', [])}
+
+        # The map keeps its own handle, and it is never closed explicitly: other
+        # threads may still be reading a bundle that was just replaced, so it is
+        # unmapped once the last reference is gone
+        with open(os.path.join(self.path, 'media.pack'), 'rb') as pack_file:
+            if os.fstat(pack_file.fileno()).st_size > 0:
+                self._pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._pack = None
+        self.embeddings = np.load(os.path.join(self.path, 'embeddings.npy'), mmap_mode='r')
+
+    def rows(self, table, **filters):
+        """Return the rows of an archived table matching all given column values"""
+        return [
+            row for row in self.tables.get(table, [])
+            if all(row.get(column) == value for column, value in filters.items())
+        ]
+
+    def has_media(self, path):
+        return _media_relpath(path) in self.media_index
+
+    def media_digest(self, path):
+        return self.media_index[_media_relpath(path)][2]
+
+    def read_media(self, path):
+        """Return a zero-copy view of a packed media file, or None if it isn't in the bundle"""
+        entry = self.media_index.get(_media_relpath(path))
+        if entry is None or self._pack is None:
+            return None
+        offset, length = entry[0], entry[1]
+        return memoryview(self._pack)[offset:offset + length]
+
+    def embedding(self, index):
+        return None if index is None else np.asarray(self.embeddings[index])
+
+
+_bundles = {}
+_bundles_lock = threading.Lock()
+
+def load_bundle(event_id):
+    """Return the (cached) bundle of an archived event, or None if there is none"""
+    metadata_path = os.path.join(bundle_dir(event_id), 'metadata.json')
+    with _bundles_lock:
+        bundle = _bundles.get(event_id)
+        if not os.path.exists(metadata_path):
+            return None
+        # Another process may have restored and re-archived the event since
+        if bundle is None or bundle.mtime != os.path.getmtime(metadata_path):
+            bundle = EventBundle(event_id)
+            _bundles[event_id] = bundle
+        return bundle
+
+def _forget_bundle(event_id):
+    with _bundles_lock:
+        _bundles.pop(event_id, None)
+
+def find_archived_image(db_connection, image_id):
+    """Look up an archived image by id; returns (bundle, row) or (None, None).
+
+    The archived_images table maps the id to its event, so at most one
+    bundle is opened.
+    """
+    mapping = db_connection.execute(
+        'SELECT event_id FROM archived_images WHERE image_id = ?', (image_id,)
+    ).fetchone()
+    if mapping is None:
+        return None, None
+    bundle = load_bundle(mapping[0])
+    if bundle is None or image_id not in bundle.images_by_id:
+        return None, None
+    return bundle, bundle.images_by_id[image_id]
+
+
+def _collect_media(event_id, tables):
+    """List the static/-relative media files that belong to an event"""
+    paths = []
+    for row in tables['images']:
+        original = _media_relpath(row['file_path'])
+        paths.append(original)
+        # Pack a watermarked copy too, so archived downloads need no re-encoding
+        full_path = os.path.join(MEDIA_ROOT, original)
+        if os.path.isfile(full_path):
+            try:
+                utils.add_watermark(full_path)
+            except Exception as e:
+                print(f"Could not watermark {full_path}: {e}")
+        paths.append(utils.watermarked_path(original))
+    for row in tables['face_crops']:
+        paths.append(_media_relpath(row['file_path']))
+    for row in tables['users']:
+        if row['selfie_path']:
+            paths.append(_media_relpath(row['selfie_path']))
+    for row in tables['face_clusters']:
+        if row['representative_face_path']:
+            paths.append(_media_relpath(row['representative_face_path']))
+        paths.append(f"qrcodes/cluster_{event_id}_{row['id']}.png")
+    paths.append(f"qrcodes/event_{event_id}.png")
+
+    # Everything else in the event's directories (videos, photos without
+    # faces or rejected by the quality filter) goes into the bundle as well
+    for directory in EVENT_MEDIA_DIRS:
+        root = os.path.join(MEDIA_ROOT, directory, str(event_id))
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                paths.append(os.path.relpath(os.path.join(dirpath, filename), MEDIA_ROOT).replace('\\', '/'))
+
+    seen = set()
+    return [p for p in paths
+            if not (p in seen or seen.add(p)) and os.path.isfile(os.path.join(MEDIA_ROOT, p))]
+
+def archive_event(event_id, db_path='instance/facesnap.sqlite'):
+    """Pack an event into a read-only bundle and remove its rows and media from the hot tier"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        event = conn.execute('SELECT * FROM events WHERE id = ?', (event_id,)).fetchone()
+        if event is None:
+            print(f"Event {event_id} not found.")
+            return False
+        if event['archived_at']:
+            print(f"Event {event_id} is already archived.")
+            return False
+
+        path = bundle_dir(event_id)
+        os.makedirs(path, exist_ok=True)
+
+        # Read the event's rows, swapping pickled encodings for matrix indices
+        tables = {}
+        columns = {}
+        embeddings = []
+        for table, condition, params in ARCHIVED_TABLES:
+            cursor = conn.execute(f'SELECT * FROM {table} WHERE {condition}', (event_id,) * params)
+            columns[table] = [d[0] for d in cursor.description]
+            rows = [dict(row) for row in cursor.fetchall()]
+            column = EMBEDDING_COLUMNS.get(table)
+            for row in rows:
+                if column and row.get(column):
+                    embeddings.append(np.asarray(pickle.loads(row[column]), dtype=np.float32))
+                    row[column] = len(embeddings) - 1
+                elif column:
+                    row[column] = None
+            tables[table] = rows
+
+        # Pack media files back to back and index them by path
+        media = {}
+        offset = 0
+        with open(os.path.join(path, 'media.pack'), 'wb') as pack:
+            for relpath in _collect_media(event_id, tables):
+                sha1 = hashlib.sha1()
+                length = 0
+                with open(os.path.join(MEDIA_ROOT, relpath), 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        pack.write(chunk)
+                        sha1.update(chunk)
+                        length += len(chunk)
+                media[relpath] = [offset, length, sha1.hexdigest()[:16]]
+                offset += length
+            pack.flush()
+            os.fsync(pack.fileno())
+
+        matrix = np.vstack(embeddings) if embeddings else np.zeros((0, 128), dtype=np.float32)
+        np.save(os.path.join(path, 'embeddings.npy'), matrix)
+
+        metadata = {
+            'format': BUNDLE_FORMAT,
+            'event_id': event_id,
+            'media': media,
+            'tables': {
+                table: {'columns': columns[table], 'rows': [[row[c] for c in columns[table]] for row in rows]}
+                for table, rows in tables.items()
+            },
+        }
+        with open(os.path.join(path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, separators=(',', ':'))
+
+        for name in os.listdir(path):
+            os.chmod(os.path.join(path, name), 0o444)
+
+        # The bundle is complete, drop the event's rows from the live database,
+        # keeping only a small image id -> event id map for downloads
+        conn.executemany(
+            'INSERT OR REPLACE INTO archived_images (image_id, event_id) VALUES (?, ?)',
+            [(row['id'], event_id) for row in tables['images']]
+        )
+        for table, condition, params in reversed(ARCHIVED_TABLES):
+            conn.execute(f'DELETE FROM {table} WHERE {condition}', (event_id,) * params)
+        conn.execute('UPDATE events SET archived_at = CURRENT_TIMESTAMP WHERE id = ?', (event_id,))
+        bump_event_version(conn, event_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for relpath in media:
+        full_path = os.path.join(MEDIA_ROOT, relpath)
+        if os.path.exists(full_path):
+            os.remove(full_path)
+    for directory in EVENT_MEDIA_DIRS:
+        shutil.rmtree(os.path.join(MEDIA_ROOT, directory, str(event_id)), ignore_errors=True)
+
+    print(f"Archived event {event_id}: {len(media)} files, {len(matrix)} encodings, "
+          f"{sum(len(rows) for rows in tables.values())} rows.")
+    return True
+
+def restore_event(event_id, db_path='instance/facesnap.sqlite'):
+    """Move an archived event back into the live database and static/"""
+    bundle = load_bundle(event_id)
+    if bundle is None:
+        print(f"No archive found for event {event_id}.")
+        return False
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for table, _, _ in ARCHIVED_TABLES:
+            column = EMBEDDING_COLUMNS.get(table)
+            for row in bundle.tables.get(table, []):
+                row = dict(row)
+                if column:
+                    encoding = bundle.embedding(row[column])
+                    row[column] = None if encoding is None else pickle.dumps(encoding.astype(np.float64))
+                names = ', '.join(row)
+                placeholders = ', '.join('?' * len(row))
+                conn.execute(f'INSERT INTO {table} ({names}) VALUES ({placeholders})', tuple(row.values()))
+
+        for relpath in bundle.media_index:
+            full_path = os.path.join(MEDIA_ROOT, relpath)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'wb') as f:
+                f.write(bundle.read_media(relpath))
+
+        conn.execute('DELETE FROM archived_images WHERE event_id = ?', (event_id,))
+        conn.execute('UPDATE events SET archived_at = NULL WHERE id = ?', (event_id,))
+        bump_event_version(conn, event_id)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Database error while restoring event {event_id}: {e}")
+        return False
+    finally:
+        conn.close()
+
+    _forget_bundle(event_id)
+    path = bundle_dir(event_id)
+    for name in os.listdir(path):
+        os.chmod(os.path.join(path, name), 0o644)
+        os.remove(os.path.join(path, name))
+    os.rmdir(path)
+
+    print(f"Restored event {event_id}.")
+    return True
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive finished events into read-only bundles, or restore them.')
+    parser.add_argument('command', choices=['archive', 'restore'])
+    parser.add_argument('event_id', type=int)
+    parser.add_argument('--db', default='instance/facesnap.sqlite')
+    args = parser.parse_args()
+
+    if args.command == 'archive':
+        archive_event(args.event_id, args.db)
+    else:
+        restore_event(args.event_id, args.db)
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session, make_response
+
+
+def get_event_version(db_connection, event_id):
+    """Return the current cache version of an event (0 if never bumped)"""
+    row = db_connection.execute(
+        "SELECT version FROM event_cache_versions WHERE event_id = ?",
+        (event_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+def bump_event_version(db_connection, event_id):
+    """Invalidate all cached pages of an event by incrementing its version.
+
+    The caller is responsible for committing the connection.
+    """
+    db_connection.execute(
+        "INSERT INTO event_cache_versions (event_id, version) VALUES (?, 1) "
+        "ON CONFLICT(event_id) DO UPDATE SET version = version + 1",
+        (event_id,)
+    )
+
+
+class ResponseCache:
+    """In-process cache of rendered pages and query fragments, keyed per event.
+
+    Every entry is stored under the event's version counter, which lives in the
+    database so that all gunicorn workers see the same value. Bumping the
+    counter makes every older entry unreachable; those are evicted LRU-style.
+    """
+
+    def __init__(self, get_db, max_entries=512):
+        self.get_db = get_db
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def fragment(self, event_id, name, builder):
+        """Return a cached fragment (e.g. query results) for the current event version"""
+        version = get_event_version(self.get_db(), event_id)
+        key = ('fragment', event_id, version, name)
+        value = self._get(key)
+        if value is None:
+            value = builder()
+            self._set(key, value)
+        return value
+
+    def page(self, f):
+        """Cache a GET view's response and answer conditional requests with 304.
+
+        The wrapped view must take an ``event_id`` argument. Only successful
+        responses are stored, so 403/404 results are recomputed each time.
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Pending flash messages are rendered into the page, so skip the cache
+            if request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+
+            event_id = kwargs['event_id']
+            version = get_event_version(self.get_db(), event_id)
+            # Only the route arguments identify a page, so arbitrary query
+            # strings can't flood the cache and evict real entries
+            key = ('page', request.endpoint, tuple(sorted(kwargs.items())), request.host,
+                   session.get('user_id'), version)
+            digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+            etag = f"{event_id}-{version}-{digest}"
+
+            # Any worker can answer a revalidation from the version alone
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                entry = self._get(key)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    entry = (response.get_data(), response.mimetype)
+                    self._set(key, entry)
+                body, mimetype = entry
+                response = make_response(body)
+                response.mimetype = mimetype
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
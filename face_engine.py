@@ -10,6 +10,8 @@ from datetime import datetime
 import logging
 import dlib
 
+from cache import bump_event_version
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,6 +27,24 @@ class FaceEngine:
         self.max_image_size = 1600  # Maximum image dimension for processing
         self.min_image_size = 200  # Minimum image dimension
         
+        # Cheap OpenCV quality pre-filter, run before HOG detection
+        self.quality_check_size = 512  # Images are scored at this max dimension
+        self.min_sharpness = 10.0  # Min Laplacian variance of the downscaled image
+        self.good_face_size = 120  # Faces this wide or larger get the full size score
+        
+        # Video and burst ingestion
+        self.video_sample_fps = 2  # Frames sampled per second of video
+        self.keyframe_interval = 8  # Run face detection on every Nth sampled frame
+        self.max_sequence_frames = 40  # Upper bound on sampled frames per clip (~20s of video)
+        self.sequence_frame_size = 960  # Max frame dimension used for sequence processing
+        self.sequence_hash_threshold = 6  # Max hash bit difference to skip tracking on a non-keyframe
+        self.burst_hash_threshold = 3  # Max hash bit difference between separately uploaded burst stills
+        self.burst_window_seconds = 2  # Max EXIF capture time gap between burst stills
+        self.burst_check_size = 640  # Max dimension for the face count check on burst stills
+        self.burst_lookback = 20  # Recent images compared for burst duplicates
+        self.track_iou_threshold = 0.3  # Min box overlap to continue a track on a keyframe
+        self.track_min_score = 0.5  # Min template match score to keep following a face
+        
         # Configure folder paths
         self.upload_dir = 'static/uploads'
         self.faces_dir = 'static/faces'
@@ -53,6 +73,18 @@ class FaceEngine:
             self.logger.error(f"Database connection error: {e}")
             raise
             
+    def invalidate_event_cache(self, event_id):
+        """Bump the event's cache version so cached pages are re-rendered"""
+        try:
+            conn = self._get_db_connection()
+            try:
+                bump_event_version(conn, event_id)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.logger.error(f"Database error while invalidating cache for event {event_id}: {e}")
+            
     def ensure_event_directories(self, event_id):
         """Ensure all required directories exist for an event"""
         event_dirs = [
@@ -261,6 +293,78 @@ class FaceEngine:
         except sqlite3.Error as e:
             logger.error(f"Database error while updating cluster average: {e}")
 
+    def _add_to_cluster(self, cluster_id, face_encoding):
+        """Add a face to a known cluster, updating its average encoding."""
+        conn = self._get_db_connection()
+        try:
+            cluster = conn.execute(
+                "SELECT average_encoding, face_count FROM face_clusters WHERE id = ?", (cluster_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if cluster is None:
+            return None
+        if cluster['average_encoding']:
+            self._update_cluster_average(cluster_id, face_encoding, cluster['average_encoding'], cluster['face_count'] or 0)
+        return cluster_id
+
+    def _load_stored_selfies(self, event_id):
+        """Load the selfie encodings of an event's verified guests as one matrix.
+
+        Guests whose cluster no longer exists are left out, so their faces go
+        through the normal cluster scan instead.
+        """
+        conn = self._get_db_connection()
+        try:
+            rows = conn.execute(
+                "SELECT u.id, u.cluster_id, u.selfie_encoding FROM users u "
+                "JOIN face_clusters c ON c.id = u.cluster_id "
+                "WHERE u.event_id = ? AND u.selfie_encoding IS NOT NULL",
+                (event_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        users = []
+        encodings = []
+        for row in rows:
+            try:
+                encodings.append(pickle.loads(row['selfie_encoding']))
+                users.append({'user_id': row['id'], 'cluster_id': row['cluster_id']})
+            except Exception as e:
+                self.logger.error(f"Error loading selfie encoding for user {row['id']}: {e}")
+
+        if not users:
+            return [], None
+        return users, np.vstack(encodings)
+
+    def match_stored_selfies(self, event_id, face_encodings):
+        """Match face encodings against the event's stored selfies in one vectorized step.
+
+        Returns one entry per encoding: a dict with user_id, cluster_id and
+        distance of the closest selfie within the similarity threshold, or None.
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        users, selfie_matrix = self._load_stored_selfies(event_id)
+        if not users:
+            return [None] * len(face_encodings)
+
+        faces = np.asarray(face_encodings)
+        distances = np.linalg.norm(faces[:, np.newaxis, :] - selfie_matrix[np.newaxis, :, :], axis=2)
+        best = distances.argmin(axis=1)
+        best_distances = distances[np.arange(len(faces)), best]
+
+        matches = []
+        for index, distance in zip(best, best_distances):
+            if distance < self.face_similarity_threshold:
+                matches.append(dict(users[index], distance=float(distance)))
+            else:
+                matches.append(None)
+        return matches
+
     def save_face_crop(self, image, face_location, event_id, cluster_id):
         """Crop a face from an image and save it to the appropriate directory"""
         try:
@@ -319,8 +423,255 @@ class FaceEngine:
             logger.error(f"Error in save_face_crop: {e}")
             return None
 
-    def process_image(self, image_path, event_id):
-        """Process an uploaded image, detect faces, and assign to clusters"""
+    def perceptual_hash(self, image):
+        """Compute a 64-bit difference hash of a BGR or grayscale image as a hex string"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+    @staticmethod
+    def _hash_distance(hash_a, hash_b):
+        """Hamming distance between two perceptual hashes"""
+        return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+    def _capture_time(self, image_path):
+        """Read a photo's EXIF capture time (with sub-seconds if present), or None"""
+        try:
+            exif = Image.open(image_path).getexif()
+            exif_ifd = exif.get_ifd(0x8769)
+            value = exif_ifd.get(36867) or exif.get(306)  # DateTimeOriginal, DateTime
+            if not value:
+                return None
+            captured_at = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+            subsec = str(exif_ifd.get(37521) or '').strip('\x00 ')  # SubsecTimeOriginal
+            if subsec.isdigit():
+                captured_at = captured_at.replace(microsecond=int(subsec[:6].ljust(6, '0')))
+            return captured_at
+        except Exception as e:
+            self.logger.warning(f"Could not read capture time of {image_path}: {e}")
+            return None
+
+    def _find_burst_duplicate(self, event_id, image_hash, captured_at):
+        """Return the cluster ids of the burst shot this image repeats, if any.
+
+        Only photos taken within burst_window_seconds of each other (by EXIF
+        capture time) with nearly identical hashes count as the same burst;
+        without a capture time an image is never treated as a duplicate.
+        """
+        if captured_at is None:
+            return []
+
+        conn = self._get_db_connection()
+        try:
+            recent = conn.execute(
+                "SELECT phash, captured_at FROM images "
+                "WHERE event_id = ? AND phash IS NOT NULL AND captured_at IS NOT NULL "
+                "ORDER BY id DESC LIMIT ?",
+                (event_id, self.burst_lookback)
+            ).fetchall()
+            for row in recent:
+                gap = abs((datetime.fromisoformat(row['captured_at']) - captured_at).total_seconds())
+                if (gap <= self.burst_window_seconds and
+                        self._hash_distance(row['phash'], image_hash) <= self.burst_hash_threshold):
+                    rows = conn.execute(
+                        "SELECT DISTINCT cluster_id FROM images WHERE event_id = ? AND phash = ? AND captured_at = ?",
+                        (event_id, row['phash'], row['captured_at'])
+                    ).fetchall()
+                    return [r['cluster_id'] for r in rows if r['cluster_id'] is not None]
+            return []
+        finally:
+            conn.close()
+
+    def _quick_face_count(self, image):
+        """Count faces on a downscaled copy, a cheap check before trusting a burst match"""
+        height, width = image.shape[:2]
+        scale = min(1.0, self.burst_check_size / max(height, width))
+        small = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return len(face_recognition.face_locations(cv2.cvtColor(small, cv2.COLOR_BGR2RGB), model=self.model))
+
+    def _link_duplicate_image(self, image_path, event_id, image_hash, captured_at, cluster_ids):
+        """Attach a near-duplicate burst still to the clusters of the shot it repeats."""
+        results = []
+        conn = self._get_db_connection()
+        try:
+            db_image_path = os.path.relpath(image_path, 'static').replace('\\', '/')
+            for cluster_id in cluster_ids:
+                conn.execute(
+                    "INSERT INTO images (file_path, cluster_id, event_id, phash, captured_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (db_image_path, cluster_id, event_id, image_hash, captured_at.isoformat(), datetime.now().isoformat())
+                )
+                results.append({
+                    'face_location': None,
+                    'cluster_id': cluster_id,
+                    'face_path': None,
+                    'duplicate': True
+                })
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Database error while linking duplicate image: {e}")
+        finally:
+            conn.close()
+        return results
+
+    def assess_image_quality(self, image):
+        """Score a BGR image's size and sharpness before any face detection.
+
+        Returns a dict with the scores, a `usable` flag and the reasons an
+        image was rejected. Exposure is not checked here: a bright backdrop or
+        a dark venue says nothing about the faces, which score_faces judges on
+        their own regions.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        height, width = gray.shape[:2]
+        scale = min(1.0, self.quality_check_size / max(height, width))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+        reasons = []
+        if min(height, width) < self.min_image_size:
+            reasons.append('too small')
+        if sharpness < self.min_sharpness:
+            reasons.append('too blurry')
+
+        return {
+            'sharpness': sharpness,
+            'usable': not reasons,
+            'reasons': reasons
+        }
+
+    def score_faces(self, gray, face_locations):
+        """Score faces by sharpness, exposure and size in one vectorized pass.
+
+        Box sums come from integral images of the gray frame and its
+        Laplacian, so the cost does not grow with the number of faces.
+        Exposure is measured on each face box, so badly lit faces are only
+        down-ranked as cluster representatives, never dropped.
+        Scores are comparable across images and higher is better.
+        """
+        if len(face_locations) == 0:
+            return np.zeros(0)
+
+        height, width = gray.shape[:2]
+        boxes = np.asarray(face_locations, dtype=np.int64).reshape(-1, 4)
+        top = np.clip(boxes[:, 0], 0, height)
+        right = np.clip(boxes[:, 1], 0, width)
+        bottom = np.clip(boxes[:, 2], 0, height)
+        left = np.clip(boxes[:, 3], 0, width)
+        area = np.maximum((bottom - top) * (right - left), 1)
+
+        laplacian_sum, laplacian_sq_sum = cv2.integral2(cv2.Laplacian(gray, cv2.CV_64F))
+        gray_sum = cv2.integral(gray)
+
+        def box_sum(integral):
+            return integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+
+        laplacian_mean = box_sum(laplacian_sum) / area
+        sharpness = np.maximum(box_sum(laplacian_sq_sum) / area - laplacian_mean ** 2, 0)
+        brightness = box_sum(gray_sum) / area
+        exposure = np.clip(1.0 - np.abs(brightness - 128.0) / 128.0, 0.0, 1.0)
+        size = np.minimum(np.sqrt(area) / self.good_face_size, 1.0)
+
+        return np.log1p(sharpness) * exposure * size
+
+    def _update_representative_face(self, conn, cluster_id, face_path, quality):
+        """Make a face the cluster's thumbnail if it scores better than the current one"""
+        conn.execute(
+            "UPDATE face_clusters SET representative_face_path = ?, representative_quality = ? "
+            "WHERE id = ? AND (representative_quality IS NULL OR representative_quality < ?)",
+            (face_path, quality, cluster_id, quality)
+        )
+
+    def _store_faces(self, image, image_path, event_id, face_locations, face_encodings, image_hash=None, face_qualities=None, captured_at=None):
+        """Assign encoded faces to clusters and save their crops and image records"""
+        results = []
+        if face_qualities is None:
+            face_qualities = [None] * len(face_locations)
+        
+        # Match all new faces against verified guests' selfies at once, so
+        # their galleries pick up new photos without re-verification
+        selfie_matches = self.match_stored_selfies(event_id, face_encodings)
+
+        # Process each detected face
+        for face_location, face_encoding, selfie_match, face_quality in zip(face_locations, face_encodings, selfie_matches, face_qualities):
+            try:
+                # Faces of a known guest go straight to their cluster,
+                # anything else is clustered by similarity
+                cluster_id = None
+                if selfie_match is not None:
+                    cluster_id = self._add_to_cluster(selfie_match['cluster_id'], face_encoding)
+                # Also covers a stored selfie whose cluster no longer exists
+                if cluster_id is None:
+                    cluster_id = self.find_or_create_cluster(event_id, face_encoding)
+                if cluster_id is None:
+                    logger.warning("Failed to create or find cluster for face")
+                    continue
+
+                # Save the face crop
+                face_path = self.save_face_crop(image, face_location, event_id, cluster_id)
+
+                # Save to database
+                try:
+                    conn = self._get_db_connection()
+                    cursor = conn.cursor()
+
+                    # Store the encodings
+                    face_encoding_binary = pickle.dumps(face_encoding)
+
+                    # Get relative paths for database storage
+                    db_image_path = os.path.relpath(image_path, 'static').replace('\\', '/')
+                    db_face_path = os.path.relpath(face_path, 'static').replace('\\', '/')
+
+                    # Insert image record
+                    cursor.execute(
+                        "INSERT INTO images (file_path, cluster_id, event_id, phash, captured_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (db_image_path, cluster_id, event_id, image_hash,
+                         captured_at.isoformat() if captured_at else None, datetime.now().isoformat())
+                    )
+                    image_id = cursor.lastrowid
+
+                    # Insert face crop record
+                    cursor.execute(
+                        "INSERT INTO face_crops (file_path, face_encoding, cluster_id, image_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (db_face_path, face_encoding_binary, cluster_id, image_id, datetime.now().isoformat())
+                    )
+
+                    # Keep the cluster's best-scoring face as its thumbnail
+                    if face_quality is not None:
+                        self._update_representative_face(conn, cluster_id, db_face_path, float(face_quality))
+
+                    conn.commit()
+
+                    results.append({
+                        'face_location': face_location,
+                        'cluster_id': cluster_id,
+                        'face_path': face_path
+                    })
+
+                    logger.info(f"Successfully processed face and saved to cluster {cluster_id}")
+
+                except sqlite3.Error as e:
+                    logger.error(f"Database error while saving face: {e}")
+                    continue
+                finally:
+                    if 'conn' in locals():
+                        conn.close()
+
+            except Exception as e:
+                logger.error(f"Error processing individual face: {e}")
+                continue
+
+        
+        return results
+
+    def process_image(self, image_path, event_id, skipped=None):
+        """Process an uploaded image, detect faces, and assign to clusters.
+
+        If a list is passed as `skipped`, the reasons an image was rejected
+        by the quality pre-filter are appended to it.
+        """
         logger.info(f"Processing image: {image_path} for event: {event_id}")
         results = []
         
@@ -336,83 +687,242 @@ class FaceEngine:
                 logger.error(f"Failed to load image: {image_path}")
                 return results
                 
-            # Convert to RGB for face_recognition library
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            
-            # Detect faces
-            face_locations = face_recognition.face_locations(image_rgb, model=self.model)
-            logger.info(f"Found {len(face_locations)} faces in image")
-            
-            if not face_locations:
-                logger.warning(f"No faces detected in image: {image_path}")
+            # Hopeless shots (tiny, blurry) never reach dlib
+            quality = self.assess_image_quality(image)
+            if not quality['usable']:
+                logger.warning(f"Skipping image {image_path}: {', '.join(quality['reasons'])}")
+                if skipped is not None:
+                    skipped.extend(quality['reasons'])
                 return results
                 
-            # Get face encodings
-            face_encodings = face_recognition.face_encodings(image_rgb, face_locations)
-            
-            # Process each detected face
-            for face_location, face_encoding in zip(face_locations, face_encodings):
-                try:
-                    # Find or create a cluster for this face
-                    cluster_id = self.find_or_create_cluster(event_id, face_encoding)
-                    if cluster_id is None:
-                        logger.warning("Failed to create or find cluster for face")
-                        continue
-                        
-                    # Save the face crop
-                    face_path = self.save_face_crop(image, face_location, event_id, cluster_id)
+            # Near-identical stills of the same burst reuse the faces of the earlier
+            # shot. A match needs close capture times, a near-identical hash and
+            # the same face count on a cheap downscaled pass, so different people
+            # in the same framing are never linked to each other's clusters.
+            image_hash = self.perceptual_hash(image)
+            captured_at = self._capture_time(image_path)
+            duplicate_clusters = self._find_burst_duplicate(event_id, image_hash, captured_at)
+            if duplicate_clusters and self._quick_face_count(image) == len(duplicate_clusters):
+                logger.info(f"Image {image_path} is a near-duplicate burst frame, skipping full detection")
+                results = self._link_duplicate_image(image_path, event_id, image_hash, captured_at, duplicate_clusters)
+            else:
+                # Convert to RGB for face_recognition library
+                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                
+                # Detect faces
+                face_locations = face_recognition.face_locations(image_rgb, model=self.model)
+                logger.info(f"Found {len(face_locations)} faces in image")
+                
+                # Drop faces too small to encode reliably before the expensive encoding step
+                face_locations = [
+                    loc for loc in face_locations
+                    if loc[2] - loc[0] >= self.min_face_size and loc[1] - loc[3] >= self.min_face_size
+                ]
+                
+                if not face_locations:
+                    logger.warning(f"No usable faces detected in image: {image_path}")
+                    return results
                     
-                    # Save to database
-                    try:
-                        conn = self._get_db_connection()
-                        cursor = conn.cursor()
-                        
-                        # Store the encodings
-                        face_encoding_binary = pickle.dumps(face_encoding)
-                        
-                        # Get relative paths for database storage
-                        db_image_path = os.path.relpath(image_path, 'static').replace('\\', '/')
-                        db_face_path = os.path.relpath(face_path, 'static').replace('\\', '/')
-                        
-                        # Insert image record
-                        cursor.execute(
-                            "INSERT INTO images (file_path, cluster_id, event_id, created_at) VALUES (?, ?, ?, ?)",
-                            (db_image_path, cluster_id, event_id, datetime.now().isoformat())
-                        )
-                        image_id = cursor.lastrowid
-                        
-                        # Insert face crop record
-                        cursor.execute(
-                            "INSERT INTO face_crops (file_path, face_encoding, cluster_id, image_id, created_at) VALUES (?, ?, ?, ?, ?)",
-                            (db_face_path, face_encoding_binary, cluster_id, image_id, datetime.now().isoformat())
-                        )
-                        
-                        conn.commit()
-                        
-                        results.append({
-                            'face_location': face_location,
-                            'cluster_id': cluster_id,
-                            'face_path': face_path
-                        })
-                        
-                        logger.info(f"Successfully processed face and saved to cluster {cluster_id}")
-                        
-                    except sqlite3.Error as e:
-                        logger.error(f"Database error while saving face: {e}")
-                        continue
-                    finally:
-                        if 'conn' in locals():
-                            conn.close()
-                            
-                except Exception as e:
-                    logger.error(f"Error processing individual face: {e}")
-                    continue
+                face_qualities = self.score_faces(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), face_locations)
+                
+                # Get face encodings
+                face_encodings = face_recognition.face_encodings(image_rgb, face_locations)
+                
+                results = self._store_faces(image, image_path, event_id, face_locations, face_encodings,
+                                            image_hash, face_qualities, captured_at)
                     
         except Exception as e:
             logger.error(f"Error processing image {image_path}: {e}")
             
+        # New faces change the event's galleries and clusters, so drop cached pages
+        if results:
+            self.invalidate_event_cache(event_id)
+            
         return results
 
+    def _iter_sequence_frames(self, source):
+        """Yield (index, BGR frame, path) for a burst (list of image paths) or sampled video frames"""
+        if isinstance(source, (list, tuple)):
+            for index, path in enumerate(source[:self.max_sequence_frames]):
+                frame = cv2.imread(path)
+                if frame is None:
+                    logger.error(f"Failed to load burst frame: {path}")
+                    continue
+                yield index, frame, path
+            return
+
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            logger.error(f"Failed to open video: {source}")
+            return
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25
+            step = max(1, int(round(fps / self.video_sample_fps)))
+            index = 0
+            sampled = 0
+            # grab() skips frames without converting them, only sampled ones are retrieved
+            while sampled < self.max_sequence_frames and capture.grab():
+                if index % step == 0:
+                    ok, frame = capture.retrieve()
+                    if ok:
+                        yield index, frame, None
+                        sampled += 1
+                index += 1
+        finally:
+            capture.release()
+
+    def _limit_frame_size(self, frame):
+        """Downscale a frame so its largest side is at most sequence_frame_size"""
+        height, width = frame.shape[:2]
+        if max(height, width) <= self.sequence_frame_size:
+            return frame
+        scale = self.sequence_frame_size / max(height, width)
+        return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _box_iou(a, b):
+        """Intersection over union of two (top, right, bottom, left) boxes"""
+        top, bottom = max(a[0], b[0]), min(a[2], b[2])
+        left, right = max(a[3], b[3]), min(a[1], b[1])
+        intersection = max(0, bottom - top) * max(0, right - left)
+        area_a = (a[2] - a[0]) * (a[1] - a[3])
+        area_b = (b[2] - b[0]) * (b[1] - b[3])
+        union = area_a + area_b - intersection
+        return intersection / union if union > 0 else 0.0
+
+    def _associate_tracks(self, tracks, detections):
+        """Match keyframe detections to tracks by overlap; returns (active, ended) tracks"""
+        active = []
+        unmatched = list(tracks)
+        for location in detections:
+            best_track, best_iou = None, self.track_iou_threshold
+            for track in unmatched:
+                iou = self._box_iou(track['location'], location)
+                if iou >= best_iou:
+                    best_track, best_iou = track, iou
+            if best_track is None:
+                best_track = {'location': location, 'best_score': -1.0}
+            else:
+                unmatched.remove(best_track)
+                best_track['location'] = location
+            active.append(best_track)
+        return active, unmatched
+
+    def _follow_tracks(self, tracks, gray):
+        """Move tracks to the current frame by template matching near their last box"""
+        active = []
+        ended = []
+        img_height, img_width = gray.shape[:2]
+        for track in tracks:
+            top, right, bottom, left = track['location']
+            height, width = bottom - top, right - left
+            search_top, search_bottom = max(0, top - height // 2), min(img_height, bottom + height // 2)
+            search_left, search_right = max(0, left - width // 2), min(img_width, right + width // 2)
+            window = gray[search_top:search_bottom, search_left:search_right]
+            template = track['template']
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                ended.append(track)
+                continue
+
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, max_score, _, (x, y) = cv2.minMaxLoc(scores)
+            if max_score < self.track_min_score:
+                ended.append(track)
+                continue
+
+            new_top, new_left = search_top + y, search_left + x
+            track['location'] = (new_top, new_left + template.shape[1], new_top + template.shape[0], new_left)
+            active.append(track)
+        return active, ended
+
+    def _ingest_track(self, track, event_id, source):
+        """Encode a finished face track once, on its best frame, and store it"""
+        frame = track['best_image']
+        location = track['best_location']
+        encodings = face_recognition.face_encodings(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), [location])
+        if not encodings:
+            return []
+
+        still_path = track['best_path']
+        if still_path is None:
+            # Keep the chosen video frame as a still so galleries can show it
+            stem = os.path.splitext(os.path.basename(source))[0]
+            still_path = os.path.join(self.upload_dir, str(event_id), f"{stem}_frame{track['best_index']}.jpg")
+            if not os.path.exists(still_path):
+                os.makedirs(os.path.dirname(still_path), exist_ok=True)
+                cv2.imwrite(still_path, frame)
+
+        return self._store_faces(frame, still_path, event_id, [location], encodings,
+                                 self.perceptual_hash(frame), [track['best_score']])
+
+    def process_sequence(self, source, event_id):
+        """Process a video clip or a burst of stills, encoding each tracked face once.
+
+        `source` is a video path or a list of image paths. Frames are sampled,
+        faces are detected on every `keyframe_interval`-th sampled frame and
+        followed in between by template matching. Keyframes are scheduled by
+        sample index alone, so a face entering a static scene is still found;
+        the perceptual hash only skips tracking and scoring on frames that
+        barely changed. Each track is encoded on its best-scoring frame only.
+        At most max_sequence_frames frames are sampled (about 20 seconds of
+        video), so a clip costs a few HOG passes on downscaled frames.
+        """
+        logger.info(f"Processing sequence: {source} for event: {event_id}")
+        results = []
+        tracks = []
+        previous_hash = None
+        sampled = 0
+        analysed = 0
+
+        try:
+            for frame_index, frame, frame_path in self._iter_sequence_frames(source):
+                keyframe = sampled % self.keyframe_interval == 0
+                sampled += 1
+                frame = self._limit_frame_size(frame)
+                # Compared with the last analysed frame, so slow changes still add up
+                frame_hash = self.perceptual_hash(frame)
+                if (not keyframe and previous_hash is not None
+                        and self._hash_distance(frame_hash, previous_hash) <= self.sequence_hash_threshold):
+                    continue
+                previous_hash = frame_hash
+                analysed += 1
+
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if keyframe:
+                    detections = [
+                        loc for loc in face_recognition.face_locations(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), model=self.model)
+                        if loc[2] - loc[0] >= self.min_face_size and loc[1] - loc[3] >= self.min_face_size
+                    ]
+                    tracks, ended = self._associate_tracks(tracks, detections)
+                else:
+                    tracks, ended = self._follow_tracks(tracks, gray)
+
+                for track in ended:
+                    results.extend(self._ingest_track(track, event_id, source))
+
+                scores = self.score_faces(gray, [track['location'] for track in tracks])
+                for track, score in zip(tracks, scores):
+                    top, right, bottom, left = track['location']
+                    track['template'] = gray[top:bottom, left:right]
+                    if score > track['best_score']:
+                        track.update(
+                            best_score=float(score),
+                            best_image=frame,
+                            best_location=track['location'],
+                            best_index=frame_index,
+                            best_path=frame_path
+                        )
+
+            for track in tracks:
+                results.extend(self._ingest_track(track, event_id, source))
+
+            logger.info(f"Sequence {source}: {analysed} of {sampled} frames analysed, {len(results)} faces stored")
+
+        except Exception as e:
+            logger.error(f"Error processing sequence {source}: {e}")
+
+        if results:
+            self.invalidate_event_cache(event_id)
 
         return results
 
@@ -427,6 +937,19 @@ class FaceEngine:
                 return {'success': False, 'message': 'Multiple faces detected in selfie. Please submit a selfie with only your face.'}
 
             selfie_encoding = face_encodings[0]
+
+            # Returning guests are recognized from the event's few stored selfies
+            # before falling back to the full cluster scan
+            returning = self.match_stored_selfies(event_id, [selfie_encoding])[0]
+            if returning is not None:
+                return {
+                    'success': True,
+                    'cluster_id': returning['cluster_id'],
+                    'user_id': returning['user_id'],
+                    'confidence': 1.0 - returning['distance'],
+                    'encoding': selfie_encoding
+                }
+
             conn = self._get_db_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT id, average_encoding FROM face_clusters WHERE event_id = ?", (event_id,))
@@ -448,7 +971,8 @@ class FaceEngine:
                 return {
                     'success': True,
                     'cluster_id': best_match_cluster_id,
-                    'confidence': 1.0 - best_match_distance
+                    'confidence': 1.0 - best_match_distance,
+                    'encoding': selfie_encoding
                 }
             else:
                 return {'success': False, 'message': 'No matching face found in our database'}
@@ -0,0 +1,144 @@
+import os
+import hashlib
+import mimetypes
+import posixpath
+from functools import lru_cache
+
+from flask import current_app, g, make_response, request, send_file, url_for
+from werkzeug.security import safe_join
+
+MEDIA_ROOT = 'static'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def resolve_media_path(filename):
+    """Return the on-disk path of a file under static/, or None if it doesn't exist.
+
+    Only ever resolves inside MEDIA_ROOT, so it is safe for request paths.
+    """
+    if not filename:
+        return None
+    filename = posixpath.normpath(filename.replace('\\', '/'))
+    if filename.startswith(MEDIA_ROOT + '/'):
+        filename = filename[len(MEDIA_ROOT) + 1:]
+    full_path = safe_join(MEDIA_ROOT, filename)
+    if full_path and os.path.isfile(full_path):
+        return full_path
+    return None
+
+def resolve_stored_path(file_path):
+    """Return the on-disk path of a file path stored in the database.
+
+    Older rows hold paths relative to the working directory rather than to
+    static/, so those are accepted too. Never pass request input here.
+    """
+    if not file_path:
+        return None
+    file_path = file_path.replace('\\', '/')
+    if os.path.isfile(file_path):
+        return file_path
+    return resolve_media_path(file_path)
+
+@lru_cache(maxsize=4096)
+def _content_digest(path, mtime_ns, size):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()[:16]
+
+def file_version(path):
+    """Return a content hash of a file for versioned URLs.
+
+    The hash is memoized on (path, mtime, size), so a file is only read
+    again after it changes, and rewriting identical bytes keeps the URL.
+    """
+    stat = os.stat(path)
+    return _content_digest(path, stat.st_mtime_ns, stat.st_size)
+
+def media_url(filename):
+    """Build a content-hashed URL for a file under static/.
+
+    Falls back to the plain static URL when the file is missing so templates
+    never break on stale database rows.
+    """
+    filename = posixpath.normpath(filename.replace('\\', '/'))
+    if filename.startswith(MEDIA_ROOT + '/'):
+        filename = filename[len(MEDIA_ROOT) + 1:]
+    full_path = safe_join(MEDIA_ROOT, filename)
+    if not full_path or not os.path.isfile(full_path):
+        # Files of archived events live in the bundle the view is rendering from
+        bundle = g.get('archive_bundle')
+        if bundle is not None and bundle.has_media(filename):
+            return url_for('archived_media', event_id=bundle.event_id,
+                           digest=bundle.media_digest(filename), filename=filename)
+        return url_for('static', filename=filename)
+    return url_for('media', digest=file_version(full_path), filename=filename)
+
+def send_media(path, immutable=False, **kwargs):
+    """Send a media file, optionally handing the byte copy off to a front proxy.
+
+    With MEDIA_OFFLOAD = 'x-accel' an empty response carrying an
+    X-Accel-Redirect header is returned and nginx streams the file from its
+    internal location. With 'x-sendfile' Flask's USE_X_SENDFILE is used.
+    Otherwise the file is sent from Python with Range support.
+    """
+    if current_app.config.get('MEDIA_OFFLOAD') == 'x-accel':
+        prefix = current_app.config.get('MEDIA_ACCEL_PREFIX', '/_media/')
+        relative_path = os.path.relpath(path, MEDIA_ROOT).replace('\\', '/')
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative_path
+        response.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if kwargs.get('as_attachment'):
+            download_name = kwargs.get('download_name') or os.path.basename(path)
+            response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    else:
+        response = send_file(path, conditional=True, **kwargs)
+
+    if immutable:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+class _BufferStream:
+    """Seekable, chunked iterator over a buffer such as a memory-mapped slice.
+
+    Range responses seek straight to the requested offset, so only the
+    requested span is copied out of the buffer, one chunk at a time.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._position = 0
+
+    def seekable(self):
+        return True
+
+    def seek(self, position):
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._position >= len(self._view):
+            raise StopIteration
+        chunk = self._view[self._position:self._position + self.chunk_size]
+        self._position += len(chunk)
+        return bytes(chunk)
+
+def send_media_bytes(data, filename, immutable=False, as_attachment=False):
+    """Send a media buffer (e.g. a memory-mapped bundle slice) with Range support"""
+    response = current_app.response_class(_BufferStream(data), direct_passthrough=True)
+    response.content_length = len(data)
+    response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if as_attachment:
+        response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(filename))
+    response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+    if immutable:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
@@ -17,6 +17,7 @@ CREATE TABLE IF NOT EXISTS events (
   location TEXT,
   description TEXT,
   created_by INTEGER,
+  archived_at TIMESTAMP NULL, -- Set while the event lives in an archive bundle
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (created_by) REFERENCES admins(id)
 );
@@ -53,6 +54,8 @@ CREATE TABLE IF NOT EXISTS images (
   file_path TEXT NOT NULL,
   cluster_id INTEGER,
   event_id INTEGER,
+  phash TEXT, -- Perceptual hash, used to spot near-duplicate burst frames
+  captured_at TIMESTAMP, -- EXIF capture time, used together with phash for bursts
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (event_id) REFERENCES events(id)
 );
@@ -62,6 +65,7 @@ CREATE TABLE IF NOT EXISTS face_clusters (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   event_id INTEGER,
   representative_face_path TEXT,
+  representative_quality REAL, -- Quality score of representative_face_path, kept as the best seen
   user_id INTEGER NULL,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (event_id) REFERENCES events(id),
@@ -78,4 +82,21 @@ CREATE TABLE IF NOT EXISTS access_logs (
   ip_address TEXT,
   FOREIGN KEY (user_id) REFERENCES users(id),
   FOREIGN KEY (event_id) REFERENCES events(id)
-);
\ No newline at end of file
+);
+
+-- Per-event version counter used to invalidate cached gallery and cluster pages
+CREATE TABLE IF NOT EXISTS event_cache_versions (
+  event_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (event_id) REFERENCES events(id)
+);
+
+-- Stored selfies are looked up per event for returning guests and new uploads
+CREATE INDEX IF NOT EXISTS idx_users_event ON users(event_id);
+
+-- Maps image ids of archived events to their event, so downloads open one bundle
+CREATE TABLE IF NOT EXISTS archived_images (
+  image_id INTEGER PRIMARY KEY,
+  event_id INTEGER NOT NULL,
+  FOREIGN KEY (event_id) REFERENCES events(id)
+);
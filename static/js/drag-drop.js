@@ -67,7 +67,7 @@ function initDragDrop(options) {
                     const card = document.createElement('div');
                     card.className = 'card h-100';
                     
-                    const img = document.createElement('img');
+                    const img = document.createElement(file.type.startsWith('video/') ? 'video' : 'img');
                     img.src = e.target.result;
                     img.className = 'card-img-top';
                     img.alt = 'Preview';
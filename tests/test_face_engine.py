@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('face_recognition')
+
+import face_engine
+from face_engine import FaceEngine
+
+
+FRAME_SIZE = (720, 1280)
+FACE_BOX = (300, 720, 420, 600)  # top, right, bottom, left in full-size frames
+
+
+def _static_scene(tmp_path, frame_count, face_from):
+    """Write a burst of identical frames with a textured 'face' entering at face_from"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 60, FRAME_SIZE + (3,), dtype=np.uint8)
+    face = rng.integers(200, 256, (120, 120, 3), dtype=np.uint8)
+    top, right, bottom, left = FACE_BOX
+
+    paths = []
+    for index in range(frame_count):
+        frame = background.copy()
+        if index >= face_from:
+            frame[top:bottom, left:right] = face
+        path = tmp_path / f"frame_{index:02d}.png"
+        cv2.imwrite(str(path), frame)
+        paths.append(str(path))
+    return paths
+
+
+def test_face_entering_static_scene_is_detected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = FaceEngine(db_path=str(tmp_path / 'facesnap.sqlite'))
+    paths = _static_scene(tmp_path, frame_count=20, face_from=4)
+
+    detections = []
+
+    def face_locations(image, model='hog'):
+        scale = image.shape[1] / FRAME_SIZE[1]
+        top, right, bottom, left = (int(v * scale) for v in FACE_BOX)
+        found = [(top, right, bottom, left)] if image[top:bottom, left:right].mean() > 150 else []
+        detections.append(found)
+        return found
+
+    stored = []
+
+    def store_faces(image, image_path, event_id, face_locations, face_encodings, *args, **kwargs):
+        stored.extend(face_locations)
+        return [{'cluster_id': 1} for _ in face_locations]
+
+    monkeypatch.setattr(face_engine.face_recognition, 'face_locations', face_locations, raising=False)
+    monkeypatch.setattr(face_engine.face_recognition, 'face_encodings',
+                        lambda image, locations: [np.zeros(128) for _ in locations], raising=False)
+    monkeypatch.setattr(engine, '_store_faces', store_faces)
+    monkeypatch.setattr(engine, 'invalidate_event_cache', lambda event_id: None)
+
+    results = engine.process_sequence(paths, event_id=1)
+
+    # Keyframes run on sample indices 0, 8 and 16 even though the scene barely changes
+    assert len(detections) == 3
+    assert detections[0] == [] and detections[1]
+    assert len(results) == 1
+    assert len(stored) == 1
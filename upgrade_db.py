@@ -1,9 +1,29 @@
 import sqlite3
 
+# Columns added after the initial schema, as (table, column, definition).
+# They are checked against PRAGMA table_info so the upgrade can be re-run safely.
+COLUMN_UPGRADES = [
+    ('face_clusters', 'average_encoding', 'BLOB'),
+    ('face_clusters', 'face_count', 'INTEGER DEFAULT 0'),
+    ('images', 'phash', 'TEXT'),
+    ('events', 'archived_at', 'TIMESTAMP NULL'),
+    ('face_clusters', 'representative_quality', 'REAL'),
+    ('images', 'captured_at', 'TIMESTAMP'),
+]
+
+def add_missing_columns(conn):
+    """Add every column from COLUMN_UPGRADES that the database doesn't have yet."""
+    for table, column, definition in COLUMN_UPGRADES:
+        existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
 def upgrade_database(db_path='instance/facesnap.sqlite', upgrade_script='upgrade_schema.sql'):
-    """Upgrades the database schema by executing a SQL script."""
+    """Upgrades the database schema by adding missing columns and executing a SQL script."""
     try:
         conn = sqlite3.connect(db_path)
+        add_missing_columns(conn)
+        conn.commit()
         cursor = conn.cursor()
         with open(upgrade_script, 'r') as f:
             sql_script = f.read()
@@ -1,2 +1,11 @@
-ALTER TABLE face_clusters ADD COLUMN average_encoding BLOB;
-ALTER TABLE face_clusters ADD COLUMN face_count INTEGER DEFAULT 0;
+CREATE TABLE IF NOT EXISTS event_cache_versions (
+  event_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (event_id) REFERENCES events(id)
+);
+CREATE INDEX IF NOT EXISTS idx_users_event ON users(event_id);
+CREATE TABLE IF NOT EXISTS archived_images (
+  image_id INTEGER PRIMARY KEY,
+  event_id INTEGER NOT NULL,
+  FOREIGN KEY (event_id) REFERENCES events(id)
+);
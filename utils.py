@@ -2,6 +2,7 @@ import os
 import uuid
 import qrcode
 from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 import cv2
 import numpy as np
 from datetime import datetime
@@ -44,6 +45,25 @@ def generate_qr_code(url, size=200):
     
     return img_bytes
 
+def _qr_is_current(qr_path, url):
+    """Check whether a QR code PNG already exists and encodes the given URL.
+
+    The URL is kept in a PNG text chunk, so only the header is read.
+    """
+    if not os.path.exists(qr_path):
+        return False
+    try:
+        with Image.open(qr_path) as img:
+            return getattr(img, 'text', {}).get('url') == url
+    except Exception:
+        return False
+
+def _save_qr(img, qr_path, url):
+    """Save a QR code image with the URL it encodes stored alongside"""
+    pnginfo = PngInfo()
+    pnginfo.add_text('url', url)
+    img.save(qr_path, pnginfo=pnginfo)
+
 def generate_event_qr(event_id, base_url):
     """Generate a QR code for an event verification page"""
     # Create directory if it doesn't exist
@@ -52,6 +72,11 @@ def generate_event_qr(event_id, base_url):
     
     # Generate the verification URL
     verify_url = f"{base_url}/event/verify?id={event_id}"
+    qr_path = os.path.join(qr_dir, f"event_{event_id}.png")
+    
+    # Rewriting an unchanged PNG would change its versioned media URL
+    if _qr_is_current(qr_path, verify_url):
+        return qr_path, verify_url
     
     # Generate QR code
     qr = qrcode.QRCode(
@@ -67,8 +92,7 @@ def generate_event_qr(event_id, base_url):
     img = qr.make_image(fill_color="black", back_color="white")
     
     # Save the QR code image
-    qr_path = os.path.join(qr_dir, f"event_{event_id}.png")
-    img.save(qr_path)
+    _save_qr(img, qr_path, verify_url)
     
     return qr_path, verify_url
 
@@ -80,6 +104,13 @@ def generate_cluster_qr(event_id, cluster_id, base_url):
     
     # Generate the verification URL
     verify_url = f"{base_url}/event/verify/{event_id}?cluster={cluster_id}"
+    qr_filename = f"cluster_{event_id}_{cluster_id}.png"
+    qr_path = os.path.join('qrcodes', qr_filename)
+    full_path = os.path.join('static', qr_path)
+    
+    # Rewriting an unchanged PNG would change its versioned media URL
+    if _qr_is_current(full_path, verify_url):
+        return qr_path
     
     # Generate QR code
     qr = qrcode.QRCode(
@@ -95,10 +126,7 @@ def generate_cluster_qr(event_id, cluster_id, base_url):
     img = qr.make_image(fill_color="black", back_color="white")
     
     # Save the QR code image
-    qr_filename = f"cluster_{event_id}_{cluster_id}.png"
-    qr_path = os.path.join('qrcodes', qr_filename)
-    full_path = os.path.join('static', qr_path)
-    img.save(full_path)
+    _save_qr(img, full_path, verify_url)
     
     return qr_path
 
@@ -110,8 +138,17 @@ def format_datetime(date_string):
     except:
         return date_string
 
+def watermarked_path(image_path):
+    """Return the path of the watermarked copy of an image"""
+    return os.path.splitext(image_path)[0] + "_watermarked" + os.path.splitext(image_path)[1]
+
 def add_watermark(image_path, text="FaceSnap by ALLIED"):
-    """Add a watermark to an image"""
+    """Add a watermark to an image, reusing the watermarked copy if it is up to date"""
+    output_path = watermarked_path(image_path)
+    if (os.path.exists(output_path) and
+            os.path.getmtime(output_path) >= os.path.getmtime(image_path)):
+        return output_path
+    
     # Load the image
     img = cv2.imread(image_path)
     
@@ -140,10 +177,9 @@ def add_watermark(image_path, text="FaceSnap by ALLIED"):
     cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0, img)
     
     # Save the watermarked image
-    watermarked_path = os.path.splitext(image_path)[0] + "_watermarked" + os.path.splitext(image_path)[1]
-    cv2.imwrite(watermarked_path, img)
+    cv2.imwrite(output_path, img)
     
-    return watermarked_path
+    return output_path
 
 def log_access(user_id, event_id, cluster_id, ip_address, db_connection):
     """Log user access to a gallery"""